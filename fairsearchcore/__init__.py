@@ -14,8 +14,8 @@ is at https://github.com/fair-search/fairsearch-core/tree/master/python.
 :copyright: (c) 2019 by Ivan Kitanovski
 :license: Apache 2.0, see LICENSE for more details.
 """
-from .fair import check_ranking, Fair
-from .simulator import compute_fail_probability, generate_rankings
+from .fair import check_ranking, check_rankings, Fair
+from .simulator import compute_fail_probability, generate_rankings, Simulator
 
 # Set default logging handler to avoid "No handler found" warnings.
 import logging
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+"""
+fairsearchcore.candidates
+~~~~~~~~~~~~~~~
+This module contains the input adapter to re-rank candidates stored in flat (memory-mapped) arrays
+"""
+
+import numpy as np
+
+from fairsearchcore import models
+
+
+class MemmapCandidates:
+    """The :class:`MemmapCandidates` object, which gives access to the candidates of many queries stored in
+    flat arrays (typically `numpy.memmap`): the scores, ids and protected flags of all the candidates, with the
+    candidates of query `i` at positions `offsets[i]` to `offsets[i + 1]`, sorted by score in descending order.
+    The queries are views of the arrays, so only the pages of the queries being re-ranked are read
+    """
+
+    def __init__(self, scores, ids, protected, offsets):
+        if not len(scores) == len(ids) == len(protected):
+            raise ValueError("The scores, ids and protected arrays must have the same length")
+        if len(offsets) < 1 or offsets[0] < 0 or offsets[-1] > len(scores) or (np.diff(offsets) < 0).any():
+            raise ValueError("The offsets must be non-decreasing, from 0 or above to within the candidate arrays")
+
+        self.scores = scores
+        self.ids = ids
+        self.protected = protected
+        self.offsets = offsets
+
+    @classmethod
+    def from_files(cls, scores_path, ids_path, protected_path, offsets_path,
+                   score_dtype=np.float64, id_dtype=np.int64, offset_dtype=np.int64):
+        """
+        Memory-maps the candidates from flat binary files (read only)
+        :param scores_path:     path of the scores (of `score_dtype`)
+        :param ids_path:        path of the ids (of `id_dtype`)
+        :param protected_path:  path of the protected flags (one byte per candidate)
+        :param offsets_path:    path of the offsets (of `offset_dtype`, number of queries + 1 values)
+        :return:                The :class:`MemmapCandidates`
+        """
+        return cls(np.memmap(scores_path, dtype=score_dtype, mode='r'),
+                   np.memmap(ids_path, dtype=id_dtype, mode='r'),
+                   np.memmap(protected_path, dtype=np.bool_, mode='r'),
+                   np.memmap(offsets_path, dtype=offset_dtype, mode='r'))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if not -len(self) <= i < len(self):
+            raise IndexError("Query index out of range")
+        i %= len(self)
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return QueryCandidates(self.scores[start:end], self.ids[start:end], self.protected[start:end])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class QueryCandidates:
+    """The :class:`QueryCandidates` object, which represents the candidates of a single query as views of the
+    flat arrays. Can be passed to :func:`Fair.re_rank <fairsearchcore.fair.Fair.re_rank>`, or split with
+    `protected_candidates` and `non_protected_candidates` for :func:`fairsearchcore.re_ranker.fair_top_k`
+    """
+
+    def __init__(self, scores, ids, protected):
+        self.scores = scores
+        self.ids = ids
+        self.protected = protected
+
+    def __len__(self):
+        return len(self.scores)
+
+    @property
+    def protected_candidates(self):
+        return CandidateSequence(self, np.flatnonzero(self.protected))
+
+    @property
+    def non_protected_candidates(self):
+        return CandidateSequence(self, np.flatnonzero(np.logical_not(self.protected)))
+
+    def doc(self, i):
+        """
+        Creates the :class:`FairScoreDoc <fairsearchcore.models.FairScoreDoc>` of the i-th candidate
+        """
+        return models.FairScoreDoc(self.ids[i].item(), self.scores[i].item(), bool(self.protected[i]))
+
+    def __repr__(self):
+        return "<QueryCandidates [%s]>" % len(self)
+
+
+class CandidateSequence:
+    """
+    A read-only sequence of the candidates of a query, which creates the `FairScoreDoc` objects only for the
+    candidates accessed by the re-ranking
+    """
+
+    def __init__(self, query, indices):
+        self._query = query
+        self._indices = indices
+
+    def __len__(self):
+        return len(self._indices)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._query.doc(j) for j in self._indices[i]]
+        return self._query.doc(self._indices[i])
@@ -7,11 +7,33 @@ Contains the classes to analytically compute fail probability
 """
 
 import abc
+import collections
+import threading
+
+import numpy as np
+from scipy.special import logsumexp
 from scipy.stats import binom
 from fairsearchcore import mtable_generator
 
 EPS = 0.0000000000000001
 
+def create_calculator(k, p, alpha, log_space=False, tolerance=None, index=None):
+    """
+    Creates the fail probability calculator for the given parameters
+    :param log_space:   Boolean indicating whether the computation is done in log space (stable for large k)
+    :param tolerance:   If set, the fail probability is approximated within this tolerance (for very large k)
+    :param index:       If set, the AdjustedAlphaIndex used to warm start the adjustment of alpha
+    :return:
+    """
+    if tolerance is not None:
+        if log_space:
+            raise ValueError("The fail probability can be computed either in log space or approximately, not both")
+        return TruncatedFailProbabilityCalculator(k, p, alpha, tolerance, index)
+    if log_space:
+        return LogSpaceFailProbabilityCalculator(k, p, alpha, index)
+    return RecursiveNumericFailProbabilityCalculator(k, p, alpha, index)
+
+
 class FailProbabilityCalculator(abc.ABC):
     """
     Base class for the fail probability calculation
@@ -40,30 +62,57 @@ class RecursiveNumericFailProbabilityCalculator(FailProbabilityCalculator):
     """
     Recursive calculation of fail probability
     """
-    def __init__(self, k, p, alpha):
+    def __init__(self, k, p, alpha, index=None):
         super().__init__(k, p, alpha)
 
+        self.index = index # the AdjustedAlphaIndex used to warm start adjust_alpha, if any
         self.legal_assignment_cache = {}
 
     def adjust_alpha(self):
-        a_min = 0
-        a_max = self.alpha
+        if self.index is None:
+            return self._adjust_alpha_between(0, self.alpha)
+
+        solved = self.index.get_solved(self._index_key())
+        if solved is not None:
+            return solved
+
+        # narrow the bracket around the adjusted alpha of the nearest solved parameters, if any
+        a_min, a_max = 0, self.alpha
+        nearest = self.index.find_nearest(self._index_key())
+        if nearest is not None:
+            nearest_alpha, nearest_pair = nearest
+            guess = min(self.alpha, nearest_pair.alpha * self.alpha / nearest_alpha)
+            low = guess * (1 - self.index.bracket_width)
+            high = min(self.alpha, guess * (1 + self.index.bracket_width))
+            if self._get_boundary(low).fail_prob <= self.alpha:
+                a_min = low
+            if self._get_boundary(high).fail_prob >= self.alpha:
+                a_max = high
+
+        result = self._adjust_alpha_between(a_min, a_max)
+        self.index.add_solved(self._index_key(), result)
+        return result
+
+    def _adjust_alpha_between(self, a_min, a_max):
+        """
+        Bisection of the alpha in [a_min, a_max] for which the fail probability of the mtable is closest to alpha
+        """
         a_mid = (a_min + a_max) / 2
 
-        minb = self._compute_boundary(a_min)
-        maxb = self._compute_boundary(a_max)
-        midb = self._compute_boundary(a_mid)
+        minb = self._get_boundary(a_min)
+        maxb = self._get_boundary(a_max)
+        midb = self._get_boundary(a_mid)
 
         while minb.mass_of_mtable() < maxb.mass_of_mtable() and midb.fail_prob != self.alpha:
             if midb.fail_prob < self.alpha:
                 a_min = a_mid
-                minb = self._compute_boundary(a_min)
+                minb = self._get_boundary(a_min)
             elif midb.fail_prob > self.alpha:
                 a_max = a_mid
-                maxb = self._compute_boundary(a_max)
+                maxb = self._get_boundary(a_max)
 
             a_mid = (a_min + a_max) / 2
-            midb = self._compute_boundary(a_mid)
+            midb = self._get_boundary(a_mid)
 
             max_mass = maxb.mass_of_mtable()
             min_mass = minb.mass_of_mtable()
@@ -102,6 +151,26 @@ class RecursiveNumericFailProbabilityCalculator(FailProbabilityCalculator):
         success_prob = self._find_legal_assignments(max_protected, block_sizes)
         return 0 if success_prob == 0 else (1 - success_prob)
 
+    def _index_key(self):
+        """
+        Key of these parameters (and of this kind of calculation) in the :class:`AdjustedAlphaIndex`
+        """
+        return type(self).__name__, getattr(self, 'tolerance', None), self.k, self.p, self.alpha
+
+    def _get_boundary(self, alpha):
+        """
+        Returns the boundary for alpha, from the index if it has been computed before
+        """
+        if self.index is None:
+            return self._compute_boundary(alpha)
+
+        key = self._index_key()[:-1] + (alpha,)
+        boundary = self.index.get_boundary(key)
+        if boundary is None:
+            boundary = self._compute_boundary(alpha)
+            self.index.add_boundary(key, boundary)
+        return boundary
+
     def _compute_boundary(self, alpha):
         """
         Returns a tuple of (k, p, alpha, fail_prob, mtable)
@@ -151,6 +220,158 @@ class RecursiveNumericFailProbabilityCalculator(FailProbabilityCalculator):
         return self.legal_assignment_cache[key]
 
 
+class LogSpaceFailProbabilityCalculator(RecursiveNumericFailProbabilityCalculator):
+    """
+    Iterative calculation of fail probability in log space. Block probabilities are combined with
+    logsumexp, so the result stays accurate for large k (or extreme p) where the products of the
+    recursive calculation underflow
+    """
+    def __init__(self, k, p, alpha, index=None):
+        super().__init__(k, p, alpha, index)
+
+        self.log_pmf_cache = {}
+
+    def calculate_fail_probability(self, mtable):
+        """
+        Analytically calculates the fail probability of the mtable
+        """
+        aux_mtable = mtable_generator.compute_aux_mtable(mtable)
+        block_sizes = [int(b) for b in aux_mtable['block'].tolist()]
+        log_success_prob = self._log_success_probability(block_sizes)
+        if log_success_prob == -np.inf:
+            return 0
+        # 1 - exp(x) without cancellation when the success probability is close to 1
+        return max(0.0, float(-np.expm1(log_success_prob)))
+
+    def get_from_log_pmf_cache(self, trials):
+        """
+        Returns the log pmf of all outcomes (0..trials) of a block with `trials` candidates
+        """
+        if not trials in self.log_pmf_cache:
+            self.log_pmf_cache[trials] = binom.logpmf(np.arange(trials + 1), trials, self.p)
+        return self.log_pmf_cache[trials]
+
+    def _log_success_probability(self, block_sizes):
+        """
+        Log probability that every block j contains enough protected candidates so that at least j of
+        them are assigned by its end. The state is the log probability of each cumulative count of
+        protected candidates, so no recursion (and no recursion limit) is involved
+        """
+        total = sum(block_sizes)
+        log_state = np.full(total + 1, -np.inf)
+        log_state[0] = 0.0
+        assigned_max = 0
+
+        for block_number, block_size in enumerate(block_sizes, start=1):
+            log_pmf = self.get_from_log_pmf_cache(block_size)
+            new_assigned_max = assigned_max + block_size
+            new_log_state = np.full(total + 1, -np.inf)
+            for items_this_block in range(block_size + 1):
+                shifted = slice(items_this_block, assigned_max + items_this_block + 1)
+                np.logaddexp(new_log_state[shifted], log_state[:assigned_max + 1] + log_pmf[items_this_block],
+                             out=new_log_state[shifted])
+            # illegal assignments: fewer than `block_number` protected candidates so far
+            new_log_state[:block_number] = -np.inf
+            log_state = new_log_state
+            assigned_max = new_assigned_max
+
+        return logsumexp(log_state)
+
+
+class TruncatedFailProbabilityCalculator(RecursiveNumericFailProbabilityCalculator):
+    """
+    Approximate calculation of fail probability for very large k. The probability of each cumulative count
+    of protected candidates is propagated block by block, and the negligible mass in the tails of the state
+    is discarded. At most `tolerance` / (number of blocks) is discarded per block, so at most `tolerance`
+    in total, and the exact fail probability is guaranteed (up to floating point rounding) to be within the
+    reported error bound, half of the discarded mass, of the estimate
+    """
+    def __init__(self, k, p, alpha, tolerance, index=None):
+        super().__init__(k, p, alpha, index)
+
+        if not 0 < tolerance < 1:
+            raise ValueError("The tolerance must be between 0 and 1")
+        self.tolerance = tolerance
+
+        self.block_pmf_cache = {}
+
+    def calculate_fail_probability(self, mtable):
+        """
+        Approximately calculates the fail probability of the mtable
+        """
+        return self.estimate_fail_probability(mtable).fail_prob
+
+    def estimate_fail_probability(self, mtable):
+        """
+        Approximately calculates the fail probability of the mtable
+        :return:            A :class:`FailProbabilityEstimate` with the estimate and its error bound
+        """
+        aux_mtable = mtable_generator.compute_aux_mtable(mtable)
+        block_sizes = [int(b) for b in aux_mtable['block'].tolist()]
+        success_prob, discarded = self._truncated_success_probability(block_sizes)
+        # the exact success probability is in [success_prob, success_prob + discarded]
+        return FailProbabilityEstimate(max(0.0, 1 - success_prob - discarded / 2), discarded / 2)
+
+    def get_from_block_pmf_cache(self, trials):
+        """
+        Returns the pmf of all outcomes (0..trials) of a block with `trials` candidates
+        """
+        if not trials in self.block_pmf_cache:
+            self.block_pmf_cache[trials] = binom.pmf(np.arange(trials + 1), trials, self.p)
+        return self.block_pmf_cache[trials]
+
+    def _compute_boundary(self, alpha):
+        """
+        Returns a tuple of (k, p, alpha, fail_prob, mtable) together with the error bound of fail_prob
+        """
+        mtable = mtable_generator.MTableGenerator(self.k, self.p, alpha, False).mtable_as_dataframe()
+        estimate = self.estimate_fail_probability(mtable)
+        return MTableFailProbPair(self.k, self.p, alpha, estimate.fail_prob, mtable, estimate.error_bound)
+
+    def _truncated_success_probability(self, block_sizes):
+        """
+        Returns the probability of the legal assignments kept in the state, and the mass discarded on the way.
+        The state only covers the window [lowest, lowest + len(state)) of cumulative counts
+        """
+        budget = self.tolerance / max(1, len(block_sizes))
+        state = np.ones(1)
+        lowest = 0
+        discarded = 0.0
+
+        for block_number, block_size in enumerate(block_sizes, start=1):
+            state = np.convolve(state, self.get_from_block_pmf_cache(block_size))
+
+            # illegal assignments: fewer than `block_number` protected candidates so far
+            illegal = min(max(0, block_number - lowest), len(state))
+            state = state[illegal:]
+            lowest += illegal
+
+            # discard the negligible tails, each within half of the budget of this block
+            low = np.searchsorted(np.cumsum(state), budget / 2, side='right')
+            high = len(state) - np.searchsorted(np.cumsum(state[::-1]), budget / 2, side='right')
+            if low >= high:
+                # the two tails cover the whole state, which is therefore within the budget of this block
+                discarded += state.sum()
+                return 0.0, float(discarded)
+            discarded += state[:low].sum() + state[high:].sum()
+            state = state[low:high]
+            lowest += low
+
+        return float(state.sum()), float(discarded)
+
+
+class FailProbabilityEstimate:
+    """
+    Approximate fail probability: the exact value is within `error_bound` of `fail_prob`
+    """
+    def __init__(self, fail_prob, error_bound):
+        self.fail_prob = fail_prob
+        self.error_bound = error_bound
+
+    def __repr__(self):
+        return "<FailProbabilityEstimate [%s +- %s]>" % (self.fail_prob, self.error_bound)
+
+
 class LegalAssignmentKey:
     """
     Utility class for the recursive fail prob
@@ -174,20 +395,90 @@ class LegalAssignmentKey:
         return True
 
     def __hash__(self):
-        return (self.remaining_candidates + len(self.remaining_block_sizes) << 16) \
+        return int(self.remaining_candidates + len(self.remaining_block_sizes) << 16) \
                + self.current_block_number + self.candidates_assigned_so_far
 
 
+class AdjustedAlphaIndex:
+    """
+    Index of the solved adjustments of alpha, by (k, p, alpha), and of the boundary mtables computed on the
+    way. The adjustment for parameters close to solved ones starts from a narrow bracket around the scaled
+    adjusted alpha of the nearest solved parameters instead of [0, alpha], and reuses the boundaries already
+    computed. Can be shared between calculators (and threads)
+    """
+
+    def __init__(self, max_distance=0.05, bracket_width=0.25, max_boundaries=4096):
+        """
+        :param max_distance:    how far (in p and in alpha) solved parameters can be to be used as a warm start
+        :param bracket_width:   the relative width of the bracket around the warm start
+        :param max_boundaries:  how many boundary mtables to keep (the least recently used are dropped)
+        """
+        self.max_distance = max_distance
+        self.bracket_width = bracket_width
+        self.max_boundaries = max_boundaries
+
+        self._solved = {}
+        self._boundaries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_solved(self, key):
+        with self._lock:
+            return self._solved.get(key)
+
+    def add_solved(self, key, pair):
+        with self._lock:
+            self._solved[key] = pair
+
+    def find_nearest(self, key):
+        """
+        Returns the solved adjustment with the same kind of calculation and k nearest to the given parameters,
+        as a tuple of (unadjusted alpha, MTableFailProbPair), or None
+        """
+        kind, tolerance, k, p, alpha = key
+        nearest, nearest_distance = None, None
+        with self._lock:
+            for (other_kind, other_tolerance, other_k, other_p, other_alpha), solved in self._solved.items():
+                if (other_kind, other_tolerance, other_k) != (kind, tolerance, k):
+                    continue
+                distance = max(abs(other_p - p), abs(other_alpha - alpha))
+                if distance <= self.max_distance and (nearest is None or distance < nearest_distance):
+                    nearest, nearest_distance = (other_alpha, solved), distance
+        return nearest
+
+    def get_boundary(self, key):
+        with self._lock:
+            boundary = self._boundaries.get(key)
+            if boundary is not None:
+                self._boundaries.move_to_end(key)
+            return boundary
+
+    def add_boundary(self, key, boundary):
+        with self._lock:
+            self._boundaries[key] = boundary
+            while len(self._boundaries) > self.max_boundaries:
+                self._boundaries.popitem(last=False)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
 class MTableFailProbPair:
     """
     Encapsulation of all parameters for the interim mtables
     """
-    def __init__(self, k, p, alpha, fail_prob, mtable):
+    def __init__(self, k, p, alpha, fail_prob, mtable, error_bound=0):
         self.k = k
         self.p = p
         self.alpha = alpha
         self.fail_prob = fail_prob
         self.mtable = mtable
+        self.error_bound = error_bound # the fail_prob is exact unless computed approximately
 
     def mass_of_mtable(self):
         return self.mtable['m'].sum()
@@ -6,25 +6,35 @@ fairsearchcore.fair
 This module serves as a wrapper around the utilities we have created for FA*IR ranking
 """
 
+import numpy as np
 import pandas as pd
 import warnings
 
+from fairsearchcore import candidates
 from fairsearchcore import mtable_generator
 from fairsearchcore import fail_prob
 from fairsearchcore import re_ranker
+from fairsearchcore import shared
 
 
 class Fair:
-    def __init__(self, k: int, p: float, alpha: float):
+    def __init__(self, k: int, p: float, alpha: float, log_space: bool = False, tolerance: float = None,
+                 alpha_index: fail_prob.AdjustedAlphaIndex = None):
         # check the parameters first
         _validate_basic_parameters(k, p, alpha)
+        _validate_tolerance(tolerance, log_space)
 
         # assign the parameters
         self.k = k # the total number of elements
         self.p = p # the proportion of protected candidates in the top-k ranking
         self.alpha = alpha # the significance level
+        self.log_space = log_space # compute fail probabilities in log space (numerically stable for large k)
+        self.tolerance = tolerance # if set, approximate fail probabilities within this tolerance (for huge k)
+        self.alpha_index = alpha_index # if set, warm starts the adjustment of alpha from nearby solved parameters
 
         self. _cache = {}  # stores generated mtables in memory
+        self._shared = None  # the shared memory holding the mtables, see `share_mtables`
+        self._plans = {}  # stores the re-ranking plans compiled from the mtables
 
     def create_unadjusted_mtable(self):
         """
@@ -53,7 +63,8 @@ class Fair:
             _validate_alpha(alpha)
 
             # create the mtable
-            fc = mtable_generator.MTableGenerator(self.k, self.p, alpha, adjust_alpha)
+            fc = mtable_generator.MTableGenerator(self.k, self.p, alpha, adjust_alpha, self.log_space,
+                                                self.tolerance, self.alpha_index)
 
             # store as list
             self._cache[(self.k, self.p, self.alpha, adjust_alpha)] = fc.mtable_as_list()
@@ -61,14 +72,88 @@ class Fair:
         # return from cache
         return self._cache[(self.k, self.p, self.alpha, adjust_alpha)]
 
+    def create_re_ranking_plan(self):
+        """
+        Creates the re-ranking plan for the adjusted mtable, which can be reused for all the queries re-ranked
+        with these parameters (and to re-rank them page by page)
+        :return:            The :class:`ReRankingPlan <fairsearchcore.re_ranker.ReRankingPlan>`
+        """
+        return self._create_re_ranking_plan(True)
+
+    def _create_re_ranking_plan(self, adjust):
+        """
+        Creates the re-ranking plan for the adjusted or unadjusted mtable
+        :param adjust:      Boolean indicating whether to use an adjusted mtable
+        :return:
+        """
+        if not adjust in self._plans:
+            mtable = self.create_adjusted_mtable() if adjust else self.create_unadjusted_mtable()
+            self._plans[adjust] = re_ranker.ReRankingPlan(mtable)
+        return self._plans[adjust]
+
+    def share_mtables(self):
+        """
+        Publishes the adjusted mtable (and any other mtable created so far) in shared memory. Afterwards,
+        pickling this object (e.g. when sending it to `multiprocessing` or `concurrent.futures` workers) only
+        transfers the name of the shared memory, and all the workers read the same mtables without copying or
+        recomputing them. In the workers, the shared mtables are returned as read-only
+        :class:`MTableView <fairsearchcore.shared.MTableView>` objects, which behave like (and compare equal
+        to) the lists. Call `unshare_mtables` once the workers are done
+        :return:            The :class:`SharedMTables <fairsearchcore.shared.SharedMTables>` holding the mtables
+        """
+        if self._shared is None or self._shared.closed:
+            self.create_adjusted_mtable()
+            self._shared = shared.SharedMTables.publish(self._cache)
+        return self._shared
+
+    def unshare_mtables(self):
+        """
+        Releases the shared memory published by `share_mtables` (or attached to, in a worker). The mtables
+        are kept as private lists, so the object remains usable
+        :return:
+        """
+        if self._shared is not None:
+            self._cache = {key: [int(i) for i in mtable] for key, mtable in self._cache.items()}
+            if self._shared.owner:
+                self._shared.unlink()
+            else:
+                self._shared.close()
+            self._shared = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_plans'] = {}  # recompiled on demand
+        state['alpha_index'] = None  # may be large, and the mtables are already cached
+        if self._shared is not None and self._shared.closed:
+            state['_shared'] = None
+        shared_keys = set() if state['_shared'] is None else {key for key, _, _ in self._shared.layout}
+        # the workers attach to the shared memory for the shared mtables
+        state['_cache'] = {key: shared.pack_mtable(mtable) for key, mtable in self._cache.items()
+                           if key not in shared_keys}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._cache = {key: shared.unpack_mtable(packed) for key, packed in self._cache.items()}
+        if self._shared is not None:
+            self._cache.update({key: shared.MTableView(array) for key, array in self._shared.as_arrays().items()})
+
     def adjust_alpha(self) :
         """
         Computes the alpha adjusted for the given set of parameters
         :return:
         """
-        rnfpc = fail_prob.RecursiveNumericFailProbabilityCalculator(self.k, self.p, self.alpha)
-        fpp = rnfpc.adjust_alpha()
-        return fpp.alpha
+        return self.adjust_alpha_with_bound().alpha
+
+    def adjust_alpha_with_bound(self):
+        """
+        Computes the alpha adjusted for the given set of parameters, together with the fail probability of the
+        adjusted mtable and its error bound (zero unless `tolerance` is set)
+        :return:            A :class:`MTableFailProbPair <fairsearchcore.fail_prob.MTableFailProbPair>`
+        """
+        rnfpc = fail_prob.create_calculator(self.k, self.p, self.alpha, self.log_space, self.tolerance,
+                                            self.alpha_index)
+        return rnfpc.adjust_alpha()
 
     def compute_fail_probability(self, mtable):
         """
@@ -78,15 +163,25 @@ class Fair:
         if len(mtable) != self.k:
             raise ValueError("Number of elements k and mtable length must be equal!")
 
-        rnfpc = fail_prob.RecursiveNumericFailProbabilityCalculator(self.k, self.p, self.alpha)
+        rnfpc = fail_prob.create_calculator(self.k, self.p, self.alpha, self.log_space, self.tolerance)
+
+        return rnfpc.calculate_fail_probability(_mtable_as_dataframe(mtable))
+
+    def estimate_fail_probability(self, mtable):
+        """
+        Computes the probability that a ranking created with the simulator will fail to pass the mtable,
+        together with a bound on the error of the computation (zero unless `tolerance` is set)
+        :return:            A :class:`FailProbabilityEstimate <fairsearchcore.fail_prob.FailProbabilityEstimate>`
+        """
+        if self.tolerance is None:
+            return fail_prob.FailProbabilityEstimate(self.compute_fail_probability(mtable), 0)
 
-        mtable_df = pd.DataFrame(columns=["m"])
+        if len(mtable) != self.k:
+            raise ValueError("Number of elements k and mtable length must be equal!")
 
-        # transform the list into an pd.DataFrame
-        for i in range(1, len(mtable) + 1):
-            mtable_df.loc[i] = [mtable[i-1]]
+        tfpc = fail_prob.create_calculator(self.k, self.p, self.alpha, self.log_space, self.tolerance)
 
-        return rnfpc.calculate_fail_probability(mtable_df)
+        return tfpc.estimate_fail_probability(_mtable_as_dataframe(mtable))
 
     def is_fair(self, ranking):
         """
@@ -99,7 +194,8 @@ class Fair:
     def re_rank(self, ranking):
         """
         Applies FA*IR re-ranking to the input ranking with an adjusted mtable
-        :param ranking:     The ranking to be re-ranked (list of FairScoreDoc)
+        :param ranking:     The ranking to be re-ranked (list of FairScoreDoc, or the QueryCandidates of a query
+                            of :class:`MemmapCandidates <fairsearchcore.candidates.MemmapCandidates>`)
         :return:
         """
         return self._re_rank(ranking, True)
@@ -115,9 +211,13 @@ class Fair:
     def _re_rank(self, ranking, adjust):
         """
         Applies FA*IR re-ranking to the input ranking and boolean whether to use an adjusted mtable
-        :param ranking:     The ranking to be re-ranked (list of FairScoreDoc)
+        :param ranking:     The ranking to be re-ranked (list of FairScoreDoc or QueryCandidates)
         :return:
         """
+        if isinstance(ranking, candidates.QueryCandidates):
+            return self._create_re_ranking_plan(adjust).re_rank(ranking.protected_candidates,
+                                                                 ranking.non_protected_candidates)
+
         protected = []
         non_protected = []
         for item in ranking:
@@ -126,8 +226,7 @@ class Fair:
             else:
                 non_protected.append(item)
 
-        return re_ranker.fair_top_k(self.k, protected, non_protected,
-                                    self.create_adjusted_mtable() if adjust else self.create_unadjusted_mtable())
+        return self._create_re_ranking_plan(adjust).re_rank(protected, non_protected)
 
 
 def check_ranking(ranking, mtable):
@@ -151,6 +250,62 @@ def check_ranking(ranking, mtable):
     return True
 
 
+def check_rankings(rankings, mtable, offsets=None):
+    """
+    Checks if many rankings are fair in respect to the mtable at once. Rankings shorter than the mtable are
+    checked against its prefix
+    :param rankings:    The rankings to be checked: a 2-D matrix of booleans (one row per ranking, indicating
+                        the protected elements), or, with `offsets`, a 1-D array of booleans of all the rankings
+                        one after the other
+    :param mtable:      The mtable against to check (list of int)
+    :param offsets:     The positions where each ranking starts in `rankings`, followed by its length
+                        (number of rankings + 1 values), for rankings of different lengths
+    :return:            A tuple of an array of booleans indicating whether each ranking satisfies the mtable,
+                        and an array with the first position at which each ranking fails (-1 if it does not)
+    """
+    mtable = np.asarray(mtable, dtype=np.int64)
+    rankings = np.asarray(rankings, dtype=bool)
+
+    if offsets is None:
+        if rankings.ndim != 2:
+            raise ValueError("The rankings must be a 2-D matrix (or a 1-D array with offsets)")
+        if rankings.shape[1] > len(mtable):
+            raise ValueError("Rankings can not be longer than the mtable!")
+
+        # the rankings failing at each position
+        fails = np.cumsum(rankings, axis=1, dtype=np.int64) < mtable[:rankings.shape[1]]
+        passed = ~fails.any(axis=1)
+        return passed, np.where(passed, -1, fails.argmax(axis=1))
+
+    offsets = np.asarray(offsets, dtype=np.int64)
+    if rankings.ndim != 1:
+        raise ValueError("The rankings must be a 1-D array when offsets are given")
+    lengths = np.diff(offsets)
+    if (lengths < 0).any() or offsets[0] != 0 or offsets[-1] != len(rankings):
+        raise ValueError("The offsets must be non-decreasing, from 0 to the total length of the rankings")
+    if (lengths > len(mtable)).any():
+        raise ValueError("Rankings can not be longer than the mtable!")
+
+    # the position of each element in its ranking, and the protected elements up to it in its ranking
+    positions = np.arange(len(rankings)) - np.repeat(offsets[:-1], lengths)
+    prefix = np.concatenate(([0], np.cumsum(rankings, dtype=np.int64)))
+    counts = prefix[1:] - np.repeat(prefix[offsets[:-1]], lengths)
+    fails = np.flatnonzero(counts < mtable[positions])
+
+    first_failure = np.full(len(lengths), len(mtable), dtype=np.int64)
+    np.minimum.at(first_failure, np.searchsorted(offsets, fails, side='right') - 1, positions[fails])
+    passed = first_failure == len(mtable)
+    first_failure[passed] = -1
+    return passed, first_failure
+
+
+def _mtable_as_dataframe(mtable):
+    """
+    Transforms the mtable (list of int) into the pd.DataFrame used internally
+    """
+    return pd.DataFrame({"m": list(mtable)}, index=range(1, len(mtable) + 1))
+
+
 def _validate_basic_parameters(k, p, alpha):
     """
     Validates if k, p and alpha are in the required ranges
@@ -174,6 +329,22 @@ def _validate_basic_parameters(k, p, alpha):
     _validate_alpha(alpha)
 
 
+def _validate_tolerance(tolerance, log_space):
+    """
+    Validates the tolerance of the approximate fail probability, if set
+    :param tolerance:   The tolerance (between 0 and 1, exclusive)
+    :param log_space:   Whether log space computation was requested (can not be combined with a tolerance)
+    """
+    if tolerance is None:
+        return
+
+    if not 0 < tolerance < 1:
+        raise ValueError("The tolerance must be between 0 and 1")
+
+    if log_space:
+        raise ValueError("The fail probability can be computed either in log space or approximately, not both")
+
+
 def _validate_alpha(alpha):
     if alpha < 0.01 or alpha > 0.15:
         if alpha < 0.001 or alpha > 0.5:
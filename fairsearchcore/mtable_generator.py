@@ -6,6 +6,7 @@ fairsearchcore.mtable_generator
 Contains the mechanics for creating an mtable
 """
 
+import numpy as np
 import pandas as pd
 import scipy.stats as stats
 
@@ -14,15 +15,18 @@ from fairsearchcore import fail_prob
 
 class MTableGenerator:
 
-    def __init__(self, k, p, alpha, adjust_alpha):
+    def __init__(self, k, p, alpha, adjust_alpha, log_space=False, tolerance=None, alpha_index=None):
         # assign parameters
         self.k = k
         self.p = p
         self.alpha = alpha
         self.adjust_alpha = adjust_alpha
+        self.log_space = log_space
+        self.tolerance = tolerance
 
         if self.adjust_alpha:
-            fail_prob_pair = fail_prob.RecursiveNumericFailProbabilityCalculator(k, p, alpha).adjust_alpha()
+            fail_prob_pair = fail_prob.create_calculator(k, p, alpha, log_space, tolerance,
+                                                         alpha_index).adjust_alpha()
             self.adjusted_alpha = fail_prob_pair.alpha
             self._mtable = fail_prob_pair.mtable
         else:
@@ -48,12 +52,10 @@ class MTableGenerator:
         """ Computes a table containing the minimum number of protected elements
             required at each position
         """
-        mtable = pd.DataFrame(columns=["m"])
-        for i in range(1, self.k + 1):
-            if i % 2000 == 0:
-                print("Computing m: {:.0f} of {:.0f}".format(i, self.k))
-            mtable.loc[i] = [self.m(i)]
-        return mtable
+        positions = np.arange(1, self.k + 1)
+        m = stats.binom.ppf(self.adjusted_alpha if self.adjust_alpha else self.alpha, positions, self.p)
+        m[m < 0] = 0
+        return pd.DataFrame({"m": m}, index=positions)
 
 
 def compute_aux_mtable(mtable):
@@ -63,17 +65,11 @@ def compute_aux_mtable(mtable):
     if not (isinstance(mtable, pd.DataFrame)):
         raise TypeError("Internal mtable must be a DataFrame")
 
-    aux_mtable = pd.DataFrame(columns=["inv", "block"])
-    last_m_seen = 0
-    last_position = 0
-    for position in range(1, len(mtable)):
-        if position % 2000 == 0:
-            print("Computing m inverse: {:.0f} of {:.0f}".format(position, len(mtable)))
-        if mtable.at[position, "m"] == last_m_seen + 1:
-            last_m_seen += 1
-            aux_mtable.loc[position] = [position, position - last_position]
-            last_position = position
-        elif mtable.at[position, "m"] != last_m_seen:
-            raise RuntimeError("Inconsistent mtable")
-
-    return aux_mtable
+    # the last position is not part of any block
+    m = mtable.loc[list(range(1, len(mtable))), "m"].to_numpy(dtype=float)
+    increments = np.diff(m, prepend=0)
+    if ((increments != 0) & (increments != 1)).any():
+        raise RuntimeError("Inconsistent mtable")
+
+    inv = np.flatnonzero(increments == 1) + 1
+    return pd.DataFrame({"inv": inv, "block": np.diff(inv, prepend=0)}, index=inv)
@@ -66,6 +66,106 @@ def fair_top_k(k, protected_candidates, non_protected_candidates, mtable):
     return result # , __mergeTwoRankings(protected_candidates[idxProtected:], non_protected_candidates[idxNonProtected:])
 
 
+class ReRankingPlan:
+    """
+    The FA*IR re-ranking decisions that only depend on the mtable, compiled once and reused for every query
+    re-ranked with the same mtable. Between two mandatory positions the re-ranking is a plain merge of the
+    protected and non-protected candidates by score, so only the mandatory positions are checked
+    """
+
+    def __init__(self, mtable):
+        self.k = len(mtable)
+        # the minimum number of protected candidates required at each position
+        self.requirements = tuple(int(m) for m in mtable)
+        # mandatory_positions[c] is the first position at which more than c protected candidates are required
+        mandatory_positions = []
+        for i, m in enumerate(self.requirements):
+            while len(mandatory_positions) < m:
+                mandatory_positions.append(i)
+        self.mandatory_positions = tuple(mandatory_positions)
+
+    def re_rank(self, protected_candidates, non_protected_candidates):
+        """
+        Applies FA*IR re-ranking, the same as :func:`fair_top_k` with the mtable of the plan
+        :param protected_candidates:        protected candidates, sorted by score in descending order
+        :param non_protected_candidates:    non-protected candidates, sorted by score in descending order
+        :return:                            the re-ranked candidates (fewer than k if there are not enough)
+        """
+        result, _ = self.re_rank_page(protected_candidates, non_protected_candidates, self.k)
+        return result
+
+    def re_rank_page(self, protected_candidates, non_protected_candidates, page_size, state=None):
+        """
+        Applies FA*IR re-ranking to the next page only, continuing from the state of the previous pages
+        :param protected_candidates:        all the protected candidates of the query, sorted by score in
+                                            descending order
+        :param non_protected_candidates:    all the non-protected candidates of the query, sorted by score in
+                                            descending order
+        :param page_size:                   the number of positions in the page (the page ends at k at the latest)
+        :param state:                       the :class:`ReRankingState` returned for the previous page, or None
+                                            for the first page
+        :return:                            a tuple of the re-ranked candidates in the page and the state to
+                                            re-rank the next page
+        """
+        if state is None:
+            state = ReRankingState()
+
+        position = state.position
+        idx_protected = state.idx_protected
+        idx_non_protected = state.idx_non_protected
+        mandatory_positions = self.mandatory_positions
+        len_protected = len(protected_candidates)
+        len_non_protected = len(non_protected_candidates)
+        end = min(self.k, position + page_size)
+
+        result = []
+        while position < end:
+            if idx_protected >= len_protected:
+                # no more protected candidates available, fill the page with non-protected ones
+                taken = non_protected_candidates[idx_non_protected:idx_non_protected + end - position]
+                result.extend(taken)
+                idx_non_protected += len(taken)
+                position += len(taken)
+                break
+
+            # the next position at which a protected candidate is mandatory (if any)
+            if idx_protected < len(mandatory_positions):
+                next_mandatory = mandatory_positions[idx_protected]
+            else:
+                next_mandatory = self.k
+
+            if position >= next_mandatory or idx_non_protected >= len_non_protected:
+                # add a protected candidate
+                result.append(protected_candidates[idx_protected])
+                idx_protected += 1
+            elif protected_candidates[idx_protected].score >= non_protected_candidates[idx_non_protected].score:
+                # the best is a protected one
+                result.append(protected_candidates[idx_protected])
+                idx_protected += 1
+            else:
+                # the best is a non-protected one
+                result.append(non_protected_candidates[idx_non_protected])
+                idx_non_protected += 1
+            position += 1
+
+        return result, ReRankingState(position, idx_protected, idx_non_protected)
+
+
+class ReRankingState:
+    """
+    The state of a paginated re-ranking after the pages re-ranked so far: the next position and how many of
+    the protected and non-protected candidates have been used
+    """
+
+    def __init__(self, position=0, idx_protected=0, idx_non_protected=0):
+        self.position = position
+        self.idx_protected = idx_protected
+        self.idx_non_protected = idx_non_protected
+
+    def __repr__(self):
+        return "<ReRankingState [%s, %s, %s]>" % (self.position, self.idx_protected, self.idx_non_protected)
+
+
 def __mergeTwoRankings(ranking1, ranking2):
     result = ranking1 + ranking2
     result.sort(key=lambda candidate: candidate.score, reverse=True)
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+
+"""
+fairsearchcore.server
+~~~~~~~~~~~~~~~
+An optional HTTP server exposing the FA*IR re-ranking, fairness check and mtable creation, so that several
+services can share one warm mtable cache. Concurrent re-ranking requests with the same (k, p, alpha) are
+micro-batched and re-ranked together with a single re-ranking plan.
+
+Run it with `python -m fairsearchcore.server --port 8000`. All endpoints take a JSON body with `k`, `p`
+and `alpha`:
+
+* `POST /re_rank`   with a `ranking` (list of `{"id", "score", "is_protected"}`), returns the re-ranked `ranking`
+* `POST /is_fair`   with a `ranking`, returns `is_fair`
+* `POST /mtable`    with an optional `adjusted` flag (default true), returns the `mtable`
+
+Each response has the latency of its stages (in milliseconds) in the `X-Stage-*-Ms` headers: `Parse`, `Warmup`
+(computing the mtables the first time the parameters are seen), `Queue` (waiting for the batch), `Compute` and
+`Serialize`.
+"""
+
+import argparse
+import collections
+import json
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from fairsearchcore import fail_prob
+from fairsearchcore import fair
+from fairsearchcore import models
+
+
+class FairCache:
+    """
+    Thread-safe cache of the :class:`Fair <fairsearchcore.fair.Fair>` objects (and thus of their mtables and
+    re-ranking plans) by (k, p, alpha). New parameters close to cached ones adjust alpha from a warm start.
+    The objects are created outside of the lock, so requests for cached parameters never wait for new ones
+    """
+
+    def __init__(self, max_k=400, max_size=256):
+        """
+        :param max_k:       the largest k accepted
+        :param max_size:    how many parameter sets to keep (the least recently used are dropped)
+        """
+        self.max_k = max_k
+        self.max_size = max_size
+        self.alpha_index = fail_prob.AdjustedAlphaIndex()
+
+        self._fairs = collections.OrderedDict()  # (k, p, alpha) -> Future of the Fair object
+        self._lock = threading.Lock()
+
+    def get(self, k, p, alpha):
+        if k > self.max_k:
+            raise ValueError("Total number of elements `k` should be at most {0}".format(self.max_k))
+
+        key = (k, p, alpha)
+        create = False
+        with self._lock:
+            future = self._fairs.get(key)
+            if future is None:
+                future = Future()
+                self._fairs[key] = future
+                create = True
+                while len(self._fairs) > self.max_size:
+                    self._fairs.popitem(last=False)
+            else:
+                self._fairs.move_to_end(key)
+
+        if create:
+            try:
+                f = fair.Fair(k, p, alpha, alpha_index=self.alpha_index)
+                # warm up the mtable and the plan before sharing the object between threads
+                f.create_re_ranking_plan()
+            except Exception as e:
+                with self._lock:
+                    if self._fairs.get(key) is future:
+                        del self._fairs[key]
+                future.set_exception(e)
+            else:
+                future.set_result(f)
+
+        return future.result()
+
+
+class ReRankBatcher:
+    """
+    Collects the re-ranking requests with the same (k, p, alpha) arriving within `window` seconds of each
+    other and re-ranks them together
+    """
+
+    def __init__(self, cache, window):
+        self.cache = cache
+        self.window = window
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def submit(self, k, p, alpha, ranking):
+        """
+        Submits a ranking to be re-ranked with the next batch of its parameters
+        :return:            A future of a tuple of (re-ranked ranking, compute time in seconds, batch size)
+        """
+        # validate (and warm up, if not done already) the parameters before queueing
+        self.cache.get(k, p, alpha)
+
+        future = Future()
+        key = (k, p, alpha)
+        with self._lock:
+            if not key in self._pending:
+                self._pending[key] = []
+                timer = threading.Timer(self.window, self._flush, (key,))
+                timer.daemon = True
+                timer.start()
+            self._pending[key].append((ranking, future))
+        return future
+
+    def _flush(self, key):
+        with self._lock:
+            batch = self._pending.pop(key)
+
+        start = time.perf_counter()
+        try:
+            plan = self.cache.get(*key).create_re_ranking_plan()
+            results = []
+            for ranking, _ in batch:
+                protected = [doc for doc in ranking if doc.is_protected]
+                non_protected = [doc for doc in ranking if not doc.is_protected]
+                results.append(plan.re_rank(protected, non_protected))
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        elapsed = time.perf_counter() - start
+
+        for (_, future), result in zip(batch, results):
+            future.set_result((result, elapsed, len(batch)))
+
+
+class FairSearchServer(ThreadingHTTPServer):
+    """
+    The HTTP server, holding the shared mtable cache and the re-ranking batcher
+    """
+    daemon_threads = True
+
+    def __init__(self, server_address, batch_window=0.002, max_k=400, max_cache_size=256):
+        super().__init__(server_address, FairSearchRequestHandler)
+        self.cache = FairCache(max_k, max_cache_size)
+        self.batcher = ReRankBatcher(self.cache, batch_window)
+
+
+class FairSearchRequestHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        start = time.perf_counter()
+        stages = []
+        headers = {}
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            if not isinstance(request, dict):
+                raise ValueError("The request body must be a JSON object")
+            k, p, alpha = int(request['k']), float(request['p']), float(request['alpha'])
+            stages.append(('Parse', time.perf_counter() - start))
+
+            if self.path not in ('/re_rank', '/is_fair', '/mtable'):
+                self._send(404, {'error': "Unknown endpoint {0}".format(self.path)}, stages, headers)
+                return
+
+            # the mtables (and the plan) are computed only the first time the parameters are seen
+            warmup_start = time.perf_counter()
+            f = self.server.cache.get(k, p, alpha)
+            stages.append(('Warmup', time.perf_counter() - warmup_start))
+
+            if self.path == '/re_rank':
+                response = self._re_rank(k, p, alpha, _parse_ranking(request), stages, headers)
+            elif self.path == '/is_fair':
+                compute_start = time.perf_counter()
+                response = {'is_fair': f.is_fair(_parse_ranking(request))}
+                stages.append(('Compute', time.perf_counter() - compute_start))
+            else:
+                compute_start = time.perf_counter()
+                mtable = f.create_adjusted_mtable() if request.get('adjusted', True) else f.create_unadjusted_mtable()
+                response = {'mtable': [int(m) for m in mtable]}
+                stages.append(('Compute', time.perf_counter() - compute_start))
+        except (KeyError, TypeError, ValueError) as e:
+            self._send(400, {'error': str(e)}, stages, headers)
+            return
+
+        self._send(200, response, stages, headers)
+
+    def _re_rank(self, k, p, alpha, ranking, stages, headers):
+        queued = time.perf_counter()
+        re_ranked, compute, batch_size = self.server.batcher.submit(k, p, alpha, ranking).result()
+        stages.append(('Queue', time.perf_counter() - queued - compute))
+        stages.append(('Compute', compute))
+        headers['X-Batch-Size'] = str(batch_size)
+        return {'ranking': [{'id': doc.id, 'score': doc.score, 'is_protected': doc.is_protected}
+                            for doc in re_ranked]}
+
+    def _send(self, status, response, stages, headers):
+        serialize_start = time.perf_counter()
+        body = json.dumps(response).encode('utf-8')
+        stages.append(('Serialize', time.perf_counter() - serialize_start))
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for stage, seconds in stages:
+            self.send_header('X-Stage-{0}-Ms'.format(stage), '{:.3f}'.format(seconds * 1000))
+        for header, value in headers.items():
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # keep the request log quiet, as for a library
+        pass
+
+
+def _parse_ranking(request):
+    return [models.FairScoreDoc(doc['id'], doc['score'], bool(doc['is_protected'])) for doc in request['ranking']]
+
+
+def create_server(host='127.0.0.1', port=8000, batch_window=0.002, max_k=400, max_cache_size=256):
+    """
+    Creates the server (call `serve_forever` on it to start serving)
+    :param host:            the host to bind to (localhost by default)
+    :param port:            the port to bind to (0 picks a free one)
+    :param batch_window:    how long (in seconds) to collect re-ranking requests into one batch
+    :param max_k:           the largest k accepted in the requests
+    :param max_cache_size:  how many parameter sets (k, p, alpha) to keep warm
+    :return:                The :class:`FairSearchServer`
+    """
+    return FairSearchServer((host, port), batch_window, max_k, max_cache_size)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="FA*IR re-ranking server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--batch-window', type=float, default=0.002,
+                        help="how long (in seconds) to collect re-ranking requests into one batch")
+    parser.add_argument('--max-k', type=int, default=400, help="the largest k accepted in the requests")
+    parser.add_argument('--max-cache-size', type=int, default=256,
+                        help="how many parameter sets (k, p, alpha) to keep warm")
+    args = parser.parse_args(argv)
+
+    server = create_server(args.host, args.port, args.batch_window, args.max_k, args.max_cache_size)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+
+"""
+fairsearchcore.shared
+~~~~~~~~~~~~~~~
+Contains the utilities for compact mtable serialization and for sharing mtables between processes
+"""
+
+import collections.abc
+
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # Python < 3.8
+    shared_memory = None
+
+MTABLE_DTYPE = np.int32
+
+_published = set()  # names of the blocks published by this process (inherited by forked workers)
+
+
+def pack_mtable(mtable):
+    """
+    Encodes an mtable as the positions at which it increments (a fraction of the size of the mtable)
+    :param mtable:      The mtable to encode (list of int)
+    :return:            A tuple of (length, bytes of the increment positions)
+    """
+    mtable = np.asarray(mtable, dtype=MTABLE_DTYPE)
+    increments = np.diff(mtable, prepend=0)
+    if (increments < 0).any():
+        raise ValueError("The mtable must be non-decreasing")
+    positions = np.repeat(np.arange(len(mtable), dtype=np.uint32), increments)
+    return len(mtable), positions.tobytes()
+
+
+def unpack_mtable(packed):
+    """
+    Decodes an mtable encoded with `pack_mtable`
+    :param packed:      A tuple of (length, bytes of the increment positions)
+    :return:            The mtable (list of int)
+    """
+    length, data = packed
+    positions = np.frombuffer(data, dtype=np.uint32)
+    return np.cumsum(np.bincount(positions, minlength=length)).astype(int).tolist()
+
+
+class SharedMTables:
+    """
+    Read-only mtables published in a single `multiprocessing.shared_memory` block. Pickling this object
+    only transfers the name of the block and its layout, so every process attaching to it maps the same
+    memory instead of receiving (or recomputing) its own copy of the mtables
+    """
+
+    def __init__(self, shm, layout, owner):
+        self._shm = shm
+        self.layout = layout  # list of (key, offset, length)
+        self.owner = owner  # whether this process created the block (and is responsible for unlinking it)
+        self._arrays = None
+        self.closed = False
+        self._unlinked = False
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    @classmethod
+    def publish(cls, mtables):
+        """
+        Copies the mtables into a new shared memory block
+        :param mtables:     A dict of key -> mtable (list of int)
+        :return:            The :class:`SharedMTables` owning the block
+        """
+        _check_shared_memory()
+
+        layout = []
+        offset = 0
+        for key, mtable in mtables.items():
+            layout.append((key, offset, len(mtable)))
+            offset += len(mtable)
+
+        shm = shared_memory.SharedMemory(create=True, size=max(1, offset) * np.dtype(MTABLE_DTYPE).itemsize)
+        data = np.ndarray((offset,), dtype=MTABLE_DTYPE, buffer=shm.buf)
+        for key, start, length in layout:
+            data[start:start + length] = mtables[key]
+        del data
+
+        _published.add(shm.name)
+        return cls(shm, layout, True)
+
+    @classmethod
+    def attach(cls, name, layout):
+        """
+        Attaches to a shared memory block created by `publish`
+        :param name:        The name of the shared memory block
+        :param layout:      The layout of the mtables in the block
+        :return:            The :class:`SharedMTables` attached to the block
+        """
+        _check_shared_memory()
+
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # Python < 3.13 always registers the block in the resource tracker, which would unlink it when
+            # the attaching process exits, so only the publishing process keeps it registered
+            from multiprocessing import resource_tracker
+            shm = shared_memory.SharedMemory(name=name)
+            if name not in _published:
+                resource_tracker.unregister(shm._name, "shared_memory")
+
+        return cls(shm, layout, False)
+
+    def as_arrays(self):
+        """
+        Returns the mtables as read-only numpy arrays backed by the shared memory (no copies are made)
+        :return:            A dict of key -> mtable (numpy.ndarray)
+        """
+        if self._arrays is None:
+            self._arrays = {}
+            for key, start, length in self.layout:
+                array = np.ndarray((length,), dtype=MTABLE_DTYPE, buffer=self._shm.buf,
+                                   offset=start * np.dtype(MTABLE_DTYPE).itemsize)
+                array.flags.writeable = False
+                self._arrays[key] = array
+        return self._arrays
+
+    def close(self):
+        """
+        Closes the access to the shared memory from this process. Arrays returned by `as_arrays` must not
+        be used afterwards
+        """
+        if not self.closed:
+            self._arrays = None
+            self._shm.close()
+            self.closed = True
+
+    def unlink(self):
+        """
+        Closes and destroys the shared memory block. Should be called once, by the process that published it
+        """
+        self.close()
+        if not self._unlinked:
+            # a worker sharing the resource tracker of this process may have unregistered the block, register
+            # it again (registering is idempotent) so that unlinking does not make the tracker complain
+            from multiprocessing import resource_tracker
+            resource_tracker.register(self._shm._name, "shared_memory")
+            self._shm.unlink()
+            self._unlinked = True
+            _published.discard(self.name)
+
+    def __reduce__(self):
+        return SharedMTables.attach, (self.name, self.layout)
+
+
+class MTableView(collections.abc.Sequence):
+    """
+    Read-only, list-compatible view of a shared mtable: it compares equal to the list of the same mtable and
+    its items are ints, but it reads them from the shared memory instead of copying them. The underlying
+    numpy array is available as `array`
+    """
+
+    def __init__(self, array):
+        self.array = array
+
+    def __len__(self):
+        return len(self.array)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self.array[i].tolist()
+        return int(self.array[i])
+
+    def __iter__(self):
+        for m in self.array:
+            yield int(m)
+
+    def __eq__(self, other):
+        if not isinstance(other, collections.abc.Sequence) or isinstance(other, str):
+            return NotImplemented
+        return len(self) == len(other) and all(m == o for m, o in zip(self, other))
+
+    __hash__ = None
+
+    def __array__(self, dtype=None, copy=None):
+        return self.array if dtype is None else self.array.astype(dtype)
+
+    def __repr__(self):
+        return repr(self.array.tolist())
+
+    def __reduce__(self):
+        # a copy outside of the shared memory
+        return list, (self.array.tolist(),)
+
+
+def _check_shared_memory():
+    if shared_memory is None:
+        raise RuntimeError("Sharing mtables requires multiprocessing.shared_memory (Python 3.8 or newer)")
@@ -6,7 +6,12 @@ fairsearchcore.simulator
 This module serves as a wrapper for simulator functionalities
 """
 
+import json
+import os
 import random
+
+import numpy as np
+
 from fairsearchcore import fair
 from fairsearchcore import models
 
@@ -33,7 +38,142 @@ def compute_fail_probability(rankings, mtable):
     :param mtable:      an mtable to check against (list of int)
     :return:            the ratio of failed rankings
     """
-    return len(list(filter(lambda x: not fair.check_ranking(x, mtable), rankings))) * 1.0 / len(rankings)
+    if any(len(ranking) != len(mtable) for ranking in rankings):
+        raise ValueError("Number of documents in ranking and mtable length must be equal!")
+
+    protected = np.array([[element.is_protected for element in ranking] for ranking in rankings], dtype=bool)
+    passed, _ = fair.check_rankings(protected.reshape(len(rankings), len(mtable)), mtable)
+    return np.count_nonzero(~passed) * 1.0 / len(rankings)
+
+
+class Simulator:
+    """
+    Generates rankings using Yang-Stoyanovich process with its own random generator (instead of the global
+    `random` module), so that simulations are reproducible, can be checkpointed and resumed, and can be split
+    in shards by jumping ahead. Each ranking consumes exactly k draws of the generator
+    """
+
+    def __init__(self, k: int, p: float, seed: int = None):
+        """
+        :param k:           how many elements should each ranking have
+        :param p:           what is the probability that a candidate is protected
+        :param seed:        the seed of the generator (a random one is drawn if not given)
+        """
+        self.k = k
+        self.p = p
+        self.seed = np.random.SeedSequence().entropy if seed is None else seed
+        self.position = 0  # the number of rankings generated (or skipped) so far
+        self._bit_generator = np.random.PCG64(self.seed)
+        self._rng = np.random.Generator(self._bit_generator)
+
+    def jump(self, M):
+        """
+        Skips the next M rankings without generating them (e.g. to start the shard of a simulation)
+        :param M:           how many rankings to skip
+        :return:            the simulator itself
+        """
+        self._bit_generator.advance(M * self.k)
+        self.position += M
+        return self
+
+    def generate_protected(self, M):
+        """
+        Generates the next M rankings as a matrix of booleans indicating the protected candidates
+        :param M:           how many rankings to generate
+        :return:            the generated rankings (numpy.ndarray of bool with shape (M, k))
+        """
+        protected = self._rng.random((M, self.k)) <= self.p
+        self.position += M
+        return protected
+
+    def generate_rankings(self, M):
+        """
+        Generates the next M rankings
+        :param M:           how many rankings to generate
+        :return:            the generated rankings (list of lists of FairScoreDoc)
+        """
+        return [[models.FairScoreDoc(self.k - i, self.k - i, bool(is_protected))
+                 for i, is_protected in enumerate(ranking)]
+                for ranking in self.generate_protected(M)]
+
+    def get_state(self):
+        """
+        Returns the state of the simulator, which can be serialized as JSON
+        :return:            the state (dict)
+        """
+        return {'k': self.k, 'p': self.p, 'seed': self.seed, 'position': self.position,
+                'bit_generator': self._bit_generator.state}
+
+    @classmethod
+    def from_state(cls, state):
+        """
+        Restores a simulator from a state returned by `get_state`
+        :param state:       the state (dict)
+        :return:            the simulator, continuing where the original one was
+        """
+        simulator = cls(state['k'], state['p'], state['seed'])
+        simulator.position = state['position']
+        simulator._bit_generator.state = state['bit_generator']
+        return simulator
+
+    def compute_fail_probability(self, mtable, M, checkpoint_path=None, checkpoint_every=1000):
+        """
+        Generates the next M rankings and computes experimentally how many of them fail to satisfy the mtable.
+        If a checkpoint path is given, the progress is saved there after every `checkpoint_every` rankings, and
+        a run with the same path continues from the saved progress instead of starting over
+        :param mtable:              an mtable to check against (list of int)
+        :param M:                   how many rankings to check in total
+        :param checkpoint_path:     the path of the checkpoint file (JSON)
+        :param checkpoint_every:    how many rankings to check between checkpoints
+        :return:                    the ratio of failed rankings
+        """
+        if len(mtable) != self.k:
+            raise ValueError("Number of elements k and mtable length must be equal!")
+
+        mtable = [int(m) for m in mtable]
+        done = 0
+        failed = 0
+
+        simulator = self
+        if checkpoint_path is not None and os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as f:
+                checkpoint = json.load(f)
+            if checkpoint['mtable'] != mtable:
+                raise ValueError("The checkpoint was created for a different mtable")
+            saved = checkpoint['simulator']
+            if (saved['k'], saved['p'], saved['seed']) != (self.k, self.p, self.seed):
+                raise ValueError("The checkpoint was created by a simulator with different k, p or seed")
+            if checkpoint['done'] > M:
+                raise ValueError("The checkpoint has already checked more than M rankings")
+            simulator = Simulator.from_state(checkpoint['simulator'])
+            done = checkpoint['done']
+            failed = checkpoint['failed']
+
+        while done < M:
+            batch = min(checkpoint_every, M - done)
+            passed, _ = fair.check_rankings(simulator.generate_protected(batch), mtable)
+            failed += int(np.count_nonzero(~passed))
+            done += batch
+
+            if checkpoint_path is not None:
+                _write_checkpoint(checkpoint_path, {'simulator': simulator.get_state(), 'mtable': mtable,
+                                                    'done': done, 'failed': failed})
+
+        if simulator is not self:
+            self.position = simulator.position
+            self._bit_generator.state = simulator._bit_generator.state
+
+        return failed * 1.0 / M
+
+
+def _write_checkpoint(path, checkpoint):
+    """
+    Writes the checkpoint atomically, so that an interruption never leaves a partial file behind
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
 
 
 def _generate_ranking(k, p):
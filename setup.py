@@ -16,6 +16,7 @@ setup(
     keywords=['search','fairness', 'fa*ir', 'ranking', 'reranking'],
     python_requires=">=3.0",
     install_requires=[
+        'numpy',
         'pandas>=0.23',
         'scipy>=1.1.0',
     ],
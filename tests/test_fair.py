@@ -1,7 +1,17 @@
+import concurrent.futures
+import multiprocessing
+import pickle
+import random
+
+import numpy as np
 import pytest
 
+from fairsearchcore import candidates
+from fairsearchcore import fail_prob
 from fairsearchcore import fair
 from fairsearchcore import models
+from fairsearchcore import re_ranker
+from fairsearchcore import shared
 
 @pytest.mark.parametrize("k, p, alpha, ranking",(
                          (20, 0.25, 0.1, [models.FairScoreDoc(20,20,False),models.FairScoreDoc(19,19,True),
@@ -144,3 +154,321 @@ def test_re_rank(k, p, alpha, ranking):
 
     # output should be fair
     assert f.is_fair(re_ranked)
+
+
+@pytest.mark.parametrize("k, p, alpha",(
+            (10, 0.2, 0.15),
+            (20, 0.25, 0.1),
+            (30, 0.3, 0.05)
+))
+def test_log_space_fail_probability(k, p, alpha):
+    f = fair.Fair(k, p, alpha)
+    f_log = fair.Fair(k, p, alpha, log_space=True)
+
+    mtable = f.create_unadjusted_mtable()
+
+    assert abs(f.compute_fail_probability(mtable) - f_log.compute_fail_probability(mtable)) < 1e-12
+
+    assert f.create_adjusted_mtable() == f_log.create_adjusted_mtable()
+
+
+def test_log_space_fail_probability_large_k():
+    k, p, alpha = 2000, 0.5, 0.1
+    with pytest.warns(UserWarning, match="not been tested"):
+        f = fair.Fair(k, p, alpha, log_space=True)
+    with pytest.warns(UserWarning, match="not been tested"):
+        f_reference = fair.Fair(k, p, alpha, tolerance=1e-12)
+
+    mtable = f.create_unadjusted_mtable()
+
+    prob = f.compute_fail_probability(mtable)
+    reference = f_reference.estimate_fail_probability(mtable)
+
+    assert abs(prob - reference.fail_prob) <= reference.error_bound + 1e-12
+
+
+def test_pickle():
+    f = fair.Fair(20, 0.25, 0.1)
+    mtable = f.create_adjusted_mtable()
+
+    f_copy = pickle.loads(pickle.dumps(f))
+
+    assert f_copy.create_adjusted_mtable() == mtable
+    assert (f_copy.k, f_copy.p, f_copy.alpha) == (f.k, f.p, f.alpha)
+
+
+def test_share_mtables():
+    f = fair.Fair(20, 0.25, 0.1)
+    mtable = f.create_adjusted_mtable()
+
+    f.share_mtables()
+    try:
+        # the owner keeps returning lists
+        assert f.create_adjusted_mtable() == mtable
+
+        f_worker = pickle.loads(pickle.dumps(f))
+
+        # the shared mtables are read-only views, which behave like the lists
+        worker_mtable = f_worker.create_adjusted_mtable()
+        assert isinstance(worker_mtable, shared.MTableView)
+        assert worker_mtable == mtable and mtable == worker_mtable
+        assert worker_mtable != mtable[:-1]
+        assert list(worker_mtable) == mtable and all(isinstance(m, int) for m in worker_mtable)
+        assert worker_mtable[-1] == mtable[-1] and worker_mtable[2:5] == mtable[2:5]
+        assert not worker_mtable.array.flags.writeable
+        assert fair.check_rankings(np.ones((1, 20), dtype=bool), worker_mtable)[0].all()
+
+        ranking = [models.FairScoreDoc(i, i, i % 4 == 0) for i in range(20, 0, -1)]
+        assert f_worker.is_fair(ranking) == fair.check_ranking(ranking, mtable)
+
+        f_worker.unshare_mtables()
+        assert f_worker.create_adjusted_mtable() == mtable
+    finally:
+        f.unshare_mtables()
+
+    # the object remains usable (and picklable) once the shared memory is released
+    assert f.create_adjusted_mtable() == mtable
+    assert pickle.loads(pickle.dumps(f)).create_adjusted_mtable() == mtable
+
+
+def test_share_mtables_unlinked_directly():
+    f = fair.Fair(20, 0.25, 0.1)
+    mtable = f.create_adjusted_mtable()
+
+    f.share_mtables().unlink()
+
+    assert f.create_adjusted_mtable() == mtable
+    assert pickle.loads(pickle.dumps(f)).create_adjusted_mtable() == mtable
+
+
+@pytest.mark.parametrize("start_method", ("fork", "spawn"))
+def test_share_mtables_worker_processes(start_method):
+    f = fair.Fair(20, 0.25, 0.1)
+    mtable = f.create_adjusted_mtable()
+    rankings = [[models.FairScoreDoc(i, i, (i + j) % 3 == 0) for i in range(20, 0, -1)] for j in range(8)]
+
+    f.share_mtables()
+    try:
+        context = multiprocessing.get_context(start_method)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=2, mp_context=context) as executor:
+            worker_mtables = [executor.submit(f.create_adjusted_mtable).result() for _ in range(4)]
+            worker_results = list(executor.map(f.is_fair, rankings))
+    finally:
+        f.unshare_mtables()
+
+    assert all(worker_mtable == mtable for worker_mtable in worker_mtables)
+    assert worker_results == [fair.check_ranking(ranking, mtable) for ranking in rankings]
+
+
+@pytest.mark.parametrize("k, p, alpha",(
+            (10, 0.2, 0.15),
+            (20, 0.25, 0.1),
+            (30, 0.3, 0.05),
+            (200, 0.5, 0.1)
+))
+def test_estimate_fail_probability(k, p, alpha):
+    f = fair.Fair(k, p, alpha)
+    f_approx = fair.Fair(k, p, alpha, tolerance=1e-6)
+
+    mtable = f.create_unadjusted_mtable()
+
+    exact = f.compute_fail_probability(mtable)
+    estimate = f_approx.estimate_fail_probability(mtable)
+
+    assert estimate.error_bound <= 1e-6 / 2
+    assert abs(exact - estimate.fail_prob) <= estimate.error_bound + 1e-12
+
+    assert f.create_adjusted_mtable() == f_approx.create_adjusted_mtable()
+
+
+@pytest.mark.parametrize("k, p, alpha, tolerance",(
+            (30, 0.3, 0.05, 1e-6),
+            (200, 0.05, 0.15, 0.9),
+            (50, 0.9, 0.1, 0.99)
+))
+def test_adjust_alpha_with_bound(k, p, alpha, tolerance):
+    f = fair.Fair(k, p, alpha, log_space=True)
+    f_approx = fair.Fair(k, p, alpha, tolerance=tolerance)
+
+    pair = f_approx.adjust_alpha_with_bound()
+
+    assert pair.alpha == f_approx.adjust_alpha()
+    assert pair.error_bound <= tolerance / 2
+
+    exact = f.compute_fail_probability([int(m) for m in pair.mtable['m'].tolist()])
+    assert abs(exact - pair.fail_prob) <= pair.error_bound + 1e-12
+
+
+@pytest.mark.parametrize("tolerance, log_space",(
+            (0, False),
+            (1, False),
+            (-0.1, False),
+            (1e-6, True)
+))
+def test_invalid_tolerance(tolerance, log_space):
+    with pytest.raises(ValueError):
+        fair.Fair(20, 0.25, 0.1, log_space=log_space, tolerance=tolerance)
+
+
+@pytest.mark.parametrize("k, p, alpha, n_protected, n_non_protected",(
+            (20, 0.25, 0.1, 30, 30),
+            (30, 0.3, 0.05, 5, 40),
+            (30, 0.5, 0.1, 40, 3),
+            (20, 0.25, 0.1, 6, 6)
+))
+def test_re_ranking_plan(k, p, alpha, n_protected, n_non_protected):
+    f = fair.Fair(k, p, alpha)
+    mtable = f.create_adjusted_mtable()
+    plan = f.create_re_ranking_plan()
+
+    rng = random.Random(k * n_protected + n_non_protected)
+    for _ in range(20):
+        scores = sorted((rng.random() for _ in range(n_protected + n_non_protected)), reverse=True)
+        protected_flags = [True] * n_protected + [False] * n_non_protected
+        rng.shuffle(protected_flags)
+        docs = [models.FairScoreDoc(i, score, is_protected)
+                for i, (score, is_protected) in enumerate(zip(scores, protected_flags))]
+        protected = [doc for doc in docs if doc.is_protected]
+        non_protected = [doc for doc in docs if not doc.is_protected]
+
+        expected = re_ranker.fair_top_k(k, protected, non_protected, mtable)
+        if isinstance(expected, tuple):
+            # fair_top_k returns a tuple when it runs out of candidates
+            expected = expected[0]
+
+        assert plan.re_rank(protected, non_protected) == expected
+
+        for page_size in (1, 3, 7, k):
+            pages = []
+            state = None
+            while state is None or state.position < min(k, len(docs)):
+                page, state = plan.re_rank_page(protected, non_protected, page_size, state)
+                assert len(page) <= page_size
+                pages.extend(page)
+
+            assert pages == expected
+
+
+def test_re_rank_memmap_candidates(tmp_path):
+    f = fair.Fair(20, 0.25, 0.1)
+    mtable = f.create_adjusted_mtable()
+
+    rng = random.Random(3)
+    queries = []
+    for size in (40, 25, 12, 60):
+        scores = sorted((rng.random() for _ in range(size)), reverse=True)
+        queries.append([models.FairScoreDoc(len(queries) * 1000 + i, score, rng.random() < 0.2)
+                        for i, score in enumerate(scores)])
+
+    docs = [doc for query in queries for doc in query]
+    np.array([doc.score for doc in docs], dtype=np.float64).tofile(str(tmp_path / "scores.bin"))
+    np.array([doc.id for doc in docs], dtype=np.int64).tofile(str(tmp_path / "ids.bin"))
+    np.array([doc.is_protected for doc in docs], dtype=np.bool_).tofile(str(tmp_path / "protected.bin"))
+    np.cumsum([0] + [len(query) for query in queries]).astype(np.int64).tofile(str(tmp_path / "offsets.bin"))
+
+    source = candidates.MemmapCandidates.from_files(str(tmp_path / "scores.bin"), str(tmp_path / "ids.bin"),
+                                                    str(tmp_path / "protected.bin"), str(tmp_path / "offsets.bin"))
+    assert len(source) == len(queries)
+
+    for query, query_candidates in zip(queries, source):
+        # the query is a view of the mapped arrays
+        assert isinstance(query_candidates.scores, np.memmap)
+
+        expected = [doc.id for doc in f.re_rank(query)]
+
+        assert [doc.id for doc in f.re_rank(query_candidates)] == expected
+
+        re_ranked = re_ranker.fair_top_k(f.k, query_candidates.protected_candidates,
+                                         query_candidates.non_protected_candidates, mtable)
+        if isinstance(re_ranked, tuple):
+            # fair_top_k returns a tuple when it runs out of candidates
+            re_ranked = re_ranked[0]
+        assert [doc.id for doc in re_ranked] == expected
+
+
+@pytest.mark.parametrize("k, alpha, p, new_p",(
+            (50, 0.1, 0.25, 0.26),
+            (100, 0.05, 0.3, 0.29),
+            (200, 0.1, 0.5, 0.52)
+))
+def test_adjusted_alpha_index(k, alpha, p, new_p):
+    index = fail_prob.AdjustedAlphaIndex()
+    fair.Fair(k, p, alpha, alpha_index=index).create_adjusted_mtable()
+
+    cold_index = fail_prob.AdjustedAlphaIndex()
+    cold = fair.Fair(k, new_p, alpha, alpha_index=cold_index).create_adjusted_mtable()
+
+    boundaries_before = len(index._boundaries)
+    warm = fair.Fair(k, new_p, alpha, alpha_index=index).create_adjusted_mtable()
+
+    # same result from the narrower bracket, with fewer boundary mtables computed
+    assert warm == cold
+    assert len(index._boundaries) - boundaries_before < len(cold_index._boundaries)
+
+    # the index is not pickled with the Fair object
+    f = fair.Fair(k, new_p, alpha, alpha_index=index)
+    f.create_adjusted_mtable()
+    f_without_index = fair.Fair(k, new_p, alpha)
+    f_without_index.create_adjusted_mtable()
+    assert len(pickle.dumps(f)) == len(pickle.dumps(f_without_index))
+    assert pickle.loads(pickle.dumps(f)).alpha_index is None
+
+    # solved parameters are answered from the index
+    assert fair.Fair(k, new_p, alpha, alpha_index=index).adjust_alpha_with_bound() is \
+           index.get_solved(("RecursiveNumericFailProbabilityCalculator", None, k, new_p, alpha))
+
+
+def _first_failure(ranking, mtable):
+    count_protected = 0
+    for i, is_protected in enumerate(ranking):
+        count_protected += 1 if is_protected else 0
+        if count_protected < mtable[i]:
+            return i
+    return -1
+
+
+def test_check_rankings():
+    mtable = fair.Fair(20, 0.3, 0.1).create_adjusted_mtable()
+
+    rng = random.Random(5)
+    rankings = [[rng.random() < 0.3 for _ in range(20)] for _ in range(200)]
+
+    passed, first_failure = fair.check_rankings(np.array(rankings), mtable)
+
+    assert passed.tolist() == [fair.check_ranking([models.FairScoreDoc(0, 0, is_protected)
+                                                   for is_protected in ranking], mtable) for ranking in rankings]
+    assert first_failure.tolist() == [_first_failure(ranking, mtable) for ranking in rankings]
+    assert not passed.all() and passed.any()
+
+
+def test_check_rankings_ragged():
+    mtable = fair.Fair(20, 0.3, 0.1).create_adjusted_mtable()
+
+    rng = random.Random(6)
+    rankings = [[rng.random() < 0.3 for _ in range(rng.choice([0, 1, 9, 15, 20]))] for _ in range(200)]
+    offsets = np.cumsum([0] + [len(ranking) for ranking in rankings])
+    flat = np.array([is_protected for ranking in rankings for is_protected in ranking], dtype=bool)
+
+    passed, first_failure = fair.check_rankings(flat, mtable, offsets)
+
+    # shorter rankings are checked against the prefix of the mtable
+    assert first_failure.tolist() == [_first_failure(ranking, mtable) for ranking in rankings]
+    assert passed.tolist() == [_first_failure(ranking, mtable) == -1 for ranking in rankings]
+
+    with pytest.raises(ValueError):
+        fair.check_rankings(np.ones((3, 21), dtype=bool), mtable)
+
+
+@pytest.mark.parametrize("offsets",(
+            [],
+            [0, 5, 3, 10],
+            [-2, 5, 10],
+            [0, 5, 11]
+))
+def test_memmap_candidates_invalid_offsets(offsets):
+    scores = np.linspace(1, 0, 10)
+    ids = np.arange(10)
+    protected = np.zeros(10, dtype=bool)
+
+    with pytest.raises(ValueError):
+        candidates.MemmapCandidates(scores, ids, protected, np.array(offsets, dtype=np.int64))
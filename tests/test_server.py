@@ -0,0 +1,126 @@
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from fairsearchcore import fair
+from fairsearchcore import models
+from fairsearchcore import server
+
+
+@pytest.fixture
+def base_url():
+    s = server.create_server(port=0, batch_window=0.5)
+    thread = threading.Thread(target=s.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:{0}".format(s.server_address[1])
+    s.shutdown()
+    s.server_close()
+
+
+def _post(url, body):
+    request = urllib.request.Request(url, data=json.dumps(body).encode("utf-8"),
+                                     headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read().decode("utf-8")), response.headers
+
+
+def _ranking(j):
+    return [models.FairScoreDoc(i, i, (i + j) % 5 == 0) for i in range(20, 0, -1)]
+
+
+def _as_json(ranking):
+    return [{"id": doc.id, "score": doc.score, "is_protected": doc.is_protected} for doc in ranking]
+
+
+def test_re_rank(base_url):
+    f = fair.Fair(20, 0.25, 0.1)
+    barrier = threading.Barrier(8)
+
+    # warm up the parameters
+    _post(base_url + "/mtable", {"k": 20, "p": 0.25, "alpha": 0.1})
+
+    def re_rank(j):
+        barrier.wait()
+        return _post(base_url + "/re_rank", {"k": 20, "p": 0.25, "alpha": 0.1, "ranking": _as_json(_ranking(j))})
+
+    # concurrent requests with the same parameters are batched
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        responses = list(executor.map(re_rank, range(8)))
+
+    for j, (response, headers) in enumerate(responses):
+        assert response["ranking"] == _as_json(f.re_rank(_ranking(j)))
+        for stage in ("Parse", "Warmup", "Queue", "Compute", "Serialize"):
+            assert float(headers["X-Stage-{0}-Ms".format(stage)]) >= 0
+    assert max(int(headers["X-Batch-Size"]) for _, headers in responses) > 1
+
+
+def test_cache_does_not_block_cached_parameters(monkeypatch):
+    cache = server.FairCache()
+    cached = cache.get(20, 0.25, 0.1)
+
+    # new parameters whose warm-up only finishes when released
+    release = threading.Event()
+
+    class SlowFair(fair.Fair):
+        def create_re_ranking_plan(self):
+            release.wait(5)
+            return super().create_re_ranking_plan()
+
+    monkeypatch.setattr(server.fair, "Fair", SlowFair)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        slow = [executor.submit(cache.get, 30, 0.3, 0.05) for _ in range(2)]
+        time.sleep(0.1)
+
+        # cached parameters are served while the new ones are being computed
+        start = time.perf_counter()
+        assert cache.get(20, 0.25, 0.1) is cached
+        assert time.perf_counter() - start < 1
+        assert not any(future.done() for future in slow)
+
+        release.set()
+        # the new parameters are computed once, for all the requests waiting for them
+        assert slow[0].result() is slow[1].result()
+
+
+def test_cache_size():
+    cache = server.FairCache(max_k=30, max_size=2)
+
+    first = cache.get(10, 0.2, 0.15)
+    cache.get(20, 0.25, 0.1)
+    cache.get(30, 0.3, 0.05)
+
+    assert cache.get(10, 0.2, 0.15) is not first
+    with pytest.raises(ValueError):
+        cache.get(31, 0.3, 0.05)
+
+
+def test_is_fair_and_mtable(base_url):
+    f = fair.Fair(20, 0.25, 0.1)
+
+    response, _ = _post(base_url + "/mtable", {"k": 20, "p": 0.25, "alpha": 0.1})
+    assert response["mtable"] == f.create_adjusted_mtable()
+
+    response, _ = _post(base_url + "/mtable", {"k": 20, "p": 0.25, "alpha": 0.1, "adjusted": False})
+    assert response["mtable"] == f.create_unadjusted_mtable()
+
+    response, _ = _post(base_url + "/is_fair", {"k": 20, "p": 0.25, "alpha": 0.1, "ranking": _as_json(_ranking(0))})
+    assert response["is_fair"] == f.is_fair(_ranking(0))
+
+
+def test_invalid_request(base_url):
+    with pytest.raises(urllib.error.HTTPError) as e:
+        _post(base_url + "/mtable", {"k": 20, "p": 0.25, "alpha": 0.9})
+    assert e.value.code == 400
+
+    with pytest.raises(urllib.error.HTTPError) as e:
+        _post(base_url + "/mtable", {"k": 401, "p": 0.25, "alpha": 0.1})
+    assert e.value.code == 400
+
+    with pytest.raises(urllib.error.HTTPError) as e:
+        _post(base_url + "/unknown", {"k": 20, "p": 0.25, "alpha": 0.1})
+    assert e.value.code == 404
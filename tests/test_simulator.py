@@ -1,3 +1,5 @@
+import json
+
 import pytest
 
 from fairsearchcore import simulator
@@ -47,3 +49,51 @@ def test_fail_probability_calcualtors():
                     # Not pretty, but adding all the parameters in the assert, so we know what combination fails
                     assert M > 0 and k > 0 and p > 0 and alpha > 0 \
                            and abs(experimental - analytical) < (allowed_offset + alpha * 0.01 / allowed_offset)
+
+
+def test_simulator_reproducible():
+    rankings = simulator.Simulator(20, 0.3, seed=42).generate_protected(100)
+
+    assert (simulator.Simulator(20, 0.3, seed=42).generate_protected(100) == rankings).all()
+    assert not (simulator.Simulator(20, 0.3, seed=43).generate_protected(100) == rankings).all()
+
+    # a jump ahead lands exactly where generating would
+    assert (simulator.Simulator(20, 0.3, seed=42).jump(60).generate_protected(40) == rankings[60:]).all()
+
+    # resuming from a saved state continues the same sequence
+    sim = simulator.Simulator(20, 0.3, seed=42)
+    sim.generate_protected(30)
+    state = json.loads(json.dumps(sim.get_state()))
+    assert (simulator.Simulator.from_state(state).generate_protected(70) == rankings[30:]).all()
+
+
+def test_simulator_checkpoint(tmp_path):
+    f = fair.Fair(20, 0.3, 0.1)
+    mtable = f.create_adjusted_mtable()
+    checkpoint_path = str(tmp_path / "checkpoint.json")
+
+    expected = simulator.Simulator(20, 0.3, seed=7).compute_fail_probability(mtable, 5000)
+
+    # an interrupted run, resumed with a fresh simulator
+    simulator.Simulator(20, 0.3, seed=7).compute_fail_probability(mtable, 2000, checkpoint_path, 500)
+    resumed = simulator.Simulator(20, 0.3, seed=7).compute_fail_probability(mtable, 5000, checkpoint_path, 500)
+
+    assert resumed == expected
+    assert abs(resumed - f.compute_fail_probability(mtable)) < 0.02
+
+
+@pytest.mark.parametrize("k, p, seed",(
+                         (20, 0.9, 1),
+                         (20, 0.3, 99)))
+def test_simulator_checkpoint_mismatch(tmp_path, k, p, seed):
+    mtable = fair.Fair(20, 0.3, 0.1).create_adjusted_mtable()
+    checkpoint_path = str(tmp_path / "checkpoint.json")
+
+    simulator.Simulator(20, 0.3, seed=1).compute_fail_probability(mtable, 1000, checkpoint_path, 500)
+
+    other = simulator.Simulator(k, p, seed=seed)
+    with pytest.raises(ValueError):
+        other.compute_fail_probability(mtable, 2000, checkpoint_path, 500)
+
+    # the simulator is left untouched
+    assert (other.p, other.seed, other.position) == (p, seed, 0)